@@ -0,0 +1,76 @@
+"""partial status indexes
+
+Revision ID: b1ee3097e1fe
+Revises: 77de3974db44
+Create Date: 2026-10-15 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b1ee3097e1fe"
+down_revision: Union[str, Sequence[str], None] = "77de3974db44"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_PARTIAL = (
+    ("feedbacks", "loaded"),
+    ("feedbacks", "generated"),
+    ("questions", "loaded"),
+    ("questions", "generated"),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY нельзя внутри транзакции
+    with op.get_context().autocommit_block():
+        for table, status in _PARTIAL:
+            op.create_index(
+                f"ix_{table}_{status}",
+                table,
+                ["id"],
+                unique=False,
+                postgresql_where=sa.text(f"status = '{status}'"),
+                postgresql_concurrently=True,
+            )
+        op.drop_index(
+            "ix_feedbacks_feedbacks_status",
+            table_name="feedbacks",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_questions_questions_status",
+            table_name="questions",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_feedbacks_feedbacks_status",
+            "feedbacks",
+            ["status"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_questions_questions_status",
+            "questions",
+            ["status"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        for table, status in _PARTIAL:
+            op.drop_index(
+                f"ix_{table}_{status}",
+                table_name=table,
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,56 @@
+"""loaded 5 star index
+
+Revision ID: 360a36f94232
+Revises: b1ee3097e1fe
+Create Date: 2026-10-15 13:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "360a36f94232"
+down_revision: Union[str, Sequence[str], None] = "b1ee3097e1fe"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # generate_answers берёт из loaded только отзывы с оценкой 5
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_feedbacks_loaded_5",
+            "feedbacks",
+            ["id"],
+            unique=False,
+            postgresql_where=sa.text("status = 'loaded' AND product_valuation = 5"),
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_feedbacks_loaded",
+            table_name="feedbacks",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_feedbacks_loaded",
+            "feedbacks",
+            ["id"],
+            unique=False,
+            postgresql_where=sa.text("status = 'loaded'"),
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_feedbacks_loaded_5",
+            table_name="feedbacks",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,44 @@
+"""failed status indexes
+
+Revision ID: 12cc0cf101b5
+Revises: 360a36f94232
+Create Date: 2026-10-15 14:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "12cc0cf101b5"
+down_revision: Union[str, Sequence[str], None] = "360a36f94232"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        for table in ("feedbacks", "questions"):
+            op.create_index(
+                f"ix_{table}_failed",
+                table,
+                ["id"],
+                unique=False,
+                postgresql_where=sa.text("status = 'failed'"),
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for table in ("feedbacks", "questions"):
+            op.drop_index(
+                f"ix_{table}_failed",
+                table_name=table,
+                postgresql_concurrently=True,
+            )
@@ -1,16 +1,33 @@
 from __future__ import annotations
+import hashlib
+import heapq
+import logging
 import os
 import re
-from typing import Tuple, Dict, List, Optional
+import tempfile
+import threading
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Tuple, Dict, List, Optional, Sequence
 
+import joblib
 import pandas as pd
 import numpy as np
 
+import sklearn
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from scipy.sparse import csr_matrix
+
+log = logging.getLogger("app.clients.catalog")
 
 _XLSX_ENV = "ARMOULE_CATALOG_XLSX"
+_TFIDF_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "armoule")
+# bump when the TF-IDF fitting changes so stale caches are ignored
+_TFIDF_CACHE_VERSION = 3
+
 
+_load_lock = threading.Lock()
 
 _cache_map: Dict[str, str] | None = None
 _cache_titles: List[str] | None = None
@@ -19,55 +36,107 @@ _cache_titles_norm: List[str] | None = None
 
 _df_cache: pd.DataFrame | None = None
 _vec_cache: TfidfVectorizer | None = None
-_matrix_cache: Optional[np.ndarray] = None
+_matrix_cache: Optional[csr_matrix] = None
+_title2rows: Dict[str, List[int]] | None = None
+_row_titles: List[str] | None = None
+_row_title_norm: List[str] | None = None
+_row_title_lower: List[str] | None = None
 
 SYS_TITLE = "__title__"
 SYS_DESC = "__desc__"
 SYS_ID = "__id__"
 
 
-def _read_xlsx() -> pd.DataFrame:
+def _xlsx_path() -> str:
     path = os.getenv(_XLSX_ENV)
     if not path:
         raise FileNotFoundError(
             f"Env {_XLSX_ENV} is not set. Set it to full path of your Excel file."
         )
-    df = pd.read_excel(path, sheet_name=0)
+    return path
+
+
+def _read_xlsx(path: str) -> pd.DataFrame:
+    df = pd.read_excel(path, sheet_name=0, engine="openpyxl", dtype=str)
     df.columns = [str(c).strip() for c in df.columns]
     return df
 
 
-def _norm_colname(s: str) -> str:
+def _tfidf_cache_path(docs: pd.Series) -> str:
+    # ключ — сами тексты: смена файла или выбора колонки описаний даёт новый кеш
+    h = hashlib.sha1(f"{sklearn.__version__}|{_TFIDF_CACHE_VERSION}".encode("utf-8"))
+    for d in docs.values:
+        h.update(str(d).encode("utf-8"))
+        h.update(b"\0")
+    return os.path.join(_TFIDF_CACHE_DIR, f"tfidf_{h.hexdigest()[:16]}.joblib")
+
+
+def _fit_tfidf(docs: pd.Series, cache_path: str) -> tuple[TfidfVectorizer, csr_matrix]:
+    if os.path.exists(cache_path):
+        try:
+            vec, matrix = joblib.load(cache_path)
+            if matrix.shape[0] == len(docs):
+                return vec, matrix
+            log.warning("TF-IDF cache has %s rows, expected %s; refitting", matrix.shape[0], len(docs))
+        except Exception as e:
+            log.warning("TF-IDF cache unreadable, refitting: %s", e)
+
+    vec = TfidfVectorizer(max_features=6000, analyzer=_pretokenized, lowercase=False)
+    matrix = normalize(vec.fit_transform(_analyze_series(docs)), norm="l2", copy=False).tocsr()
+
+    # пишем во временный файл рядом и подменяем атомарно: воркеры могут сохранять одновременно
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            joblib.dump((vec, matrix), f)
+        os.replace(tmp, cache_path)
+        tmp = None
+    except Exception as e:
+        log.warning("TF-IDF cache not saved: %s", e)
+    finally:
+        if tmp is not None:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    return vec, matrix
+
+
+# порядок важен: первый найденный алиас выигрывает
+_ID_ALIASES: tuple[str, ...] = (
+    "nm_id", "nm id", "nmid", "nm", "nm id wb",
+    "артикул wb", "артикул", "код wb", "код",
+    "wb id", "wb артикул", "id", "ид", "номер товара", "номер карточки",
+    "n mid", "nm- id", "nm-id",
+)
+_TITLE_ALIASES: tuple[str, ...] = (
+    "название wb", "наименование", "название", "product name",
+    "title", "name", "card name", "товар", "наименование товара",
+)
+_DESC_ALIASES: tuple[str, ...] = (
+    "описание", "description", "desc", "описание товара", "описание wb",
+    "описание продукта", "product description",
+)
+
+
+def _norm_colnames(columns: pd.Index) -> pd.Index:
     return (
-        s.lower()
-        .replace("\n", " ")
-        .replace("\r", " ")
-        .replace("  ", " ")
-        .strip()
+        columns.astype(str)
+        .str.lower()
+        .str.replace(r"[\r\n]", " ", regex=True)
+        .str.replace("  ", " ", regex=False)
+        .str.strip()
     )
 
 
 def _pick_cols_by_alias(df: pd.DataFrame) -> tuple[Optional[str], Optional[str], Optional[str]]:
-    norm2orig = {_norm_colname(c): c for c in df.columns}
+    norm2orig = dict(zip(_norm_colnames(df.columns), df.columns))
 
-    id_aliases = [
-        "nm_id", "nm id", "nmid", "nm", "nm id wb",
-        "артикул wb", "артикул", "код wb", "код",
-        "wb id", "wb артикул", "id", "ид", "номер товара", "номер карточки",
-        "n mid", "nm- id", "nm-id",
-    ]
-    title_aliases = [
-        "название wb", "наименование", "название", "product name",
-        "title", "name", "card name", "товар", "наименование товара",
-    ]
-    desc_aliases = [
-        "описание", "description", "desc", "описание товара", "описание wb",
-        "описание продукта", "product description"
-    ]
-
-    id_col = next((norm2orig[a] for a in id_aliases if a in norm2orig), None)
-    title_col = next((norm2orig[a] for a in title_aliases if a in norm2orig), None)
-    desc_col = next((norm2orig[a] for a in desc_aliases if a in norm2orig), None)
+    id_col = next((norm2orig[a] for a in _ID_ALIASES if a in norm2orig), None)
+    title_col = next((norm2orig[a] for a in _TITLE_ALIASES if a in norm2orig), None)
+    desc_col = next((norm2orig[a] for a in _DESC_ALIASES if a in norm2orig), None)
 
     return id_col, title_col, desc_col
 
@@ -93,6 +162,16 @@ def _score_as_title_series(s: pd.Series) -> float:
     return float(score)
 
 
+def _mostly_numeric(s: pd.Series, share: float = 0.9) -> bool:
+    # каталог читается целиком как str, поэтому цены/остатки отсеиваем по значениям, а не по dtype
+    vals = s.dropna().astype(str).str.strip()
+    vals = vals[vals != ""]
+    if len(vals) == 0:
+        return False
+    nums = pd.to_numeric(vals.str.replace(",", ".", regex=False), errors="coerce")
+    return bool(nums.notna().mean() > share)
+
+
 def _infer_cols(df: pd.DataFrame) -> tuple[Optional[str], Optional[str], Optional[str]]:
     id_candidates = []
     for c in df.columns:
@@ -103,10 +182,11 @@ def _infer_cols(df: pd.DataFrame) -> tuple[Optional[str], Optional[str], Optiona
             continue
     id_col = id_candidates[0] if id_candidates else None
 
-    title_scores = []
-    for c in df.columns:
-        if df[c].dtype == object or pd.api.types.is_string_dtype(df[c]):
-            title_scores.append((c, _score_as_title_series(df[c])))
+    str_cols = [
+        c for c in df.select_dtypes(include=["object", "string"]).columns
+        if not _mostly_numeric(df[c])
+    ]
+    title_scores = [(c, _score_as_title_series(df[c])) for c in str_cols]
     title_scores.sort(key=lambda x: x[1], reverse=True)
     title_col = title_scores[0][0] if title_scores and title_scores[0][1] > 0 else None
 
@@ -121,13 +201,22 @@ def _infer_cols(df: pd.DataFrame) -> tuple[Optional[str], Optional[str], Optiona
 
 
 def load_available() -> Tuple[Dict[str, str], List[str]]:
-    global _cache_map, _cache_titles, _cache_titles_norm
-    global _df_cache, _vec_cache, _matrix_cache
-
     if _cache_map is not None and _cache_titles is not None:
         return _cache_map, _cache_titles
 
-    df = _read_xlsx()
+    with _load_lock:
+        if _cache_map is None or _cache_titles is None:
+            _load_catalog()
+        return _cache_map, _cache_titles
+
+
+def _load_catalog() -> None:
+    global _cache_map, _cache_titles, _cache_titles_norm
+    global _df_cache, _vec_cache, _matrix_cache, _title2rows
+    global _row_titles, _row_title_norm, _row_title_lower
+
+    path = _xlsx_path()
+    df = _read_xlsx(path)
     id_col, title_col, desc_col = _pick_cols_by_alias(df)
     if id_col is None or title_col is None:
         inf_id, inf_title, inf_desc = _infer_cols(df)
@@ -141,8 +230,8 @@ def load_available() -> Tuple[Dict[str, str], List[str]]:
         raise KeyError("Не найдена колонка с названием товара в каталоге")
 
     use_df = df[[id_col, title_col] + ([desc_col] if desc_col else [])].dropna(subset=[id_col, title_col])
-    use_df[id_col] = use_df[id_col].astype(str).str.strip()
-    use_df[title_col] = use_df[title_col].astype(str).str.strip()
+    use_df[id_col] = [v.strip() for v in use_df[id_col].values]
+    use_df[title_col] = [v.strip() for v in use_df[title_col].values]
     if desc_col:
         use_df[desc_col] = use_df[desc_col].astype(str).fillna("").str.strip()
     else:
@@ -153,8 +242,6 @@ def load_available() -> Tuple[Dict[str, str], List[str]]:
     mapping = dict(zip(use_df[id_col].tolist(), use_df[title_col].tolist()))
     titles = sorted(list(set(use_df[title_col].tolist())), key=lambda s: s.lower())
 
-    _cache_map = mapping
-    _cache_titles = titles
     _cache_titles_norm = [_normalize_title(t) for t in titles]
 
     _df_cache = pd.DataFrame({
@@ -163,10 +250,20 @@ def load_available() -> Tuple[Dict[str, str], List[str]]:
         SYS_DESC: use_df[desc_col].astype(str).tolist()
     })
 
-    _vec_cache = TfidfVectorizer(max_features=6000)
-    _matrix_cache = _vec_cache.fit_transform(_clean_series(_df_cache[SYS_DESC]))
+    _vec_cache, _matrix_cache = _fit_tfidf(_df_cache[SYS_DESC], _tfidf_cache_path(_df_cache[SYS_DESC]))
+
+    _row_titles = [str(t).strip() for t in _df_cache[SYS_TITLE].values]
+    _row_title_norm = [_normalize_title(t) for t in _row_titles]
+    _row_title_lower = [t.lower() for t in _row_titles]
 
-    return _cache_map, _cache_titles
+    title2rows: Dict[str, List[int]] = {}
+    for i, t in enumerate(_row_title_lower):
+        title2rows.setdefault(t, []).append(i)
+    _title2rows = title2rows
+
+    # публикуем последними: load_available читает их без блокировки
+    _cache_map = mapping
+    _cache_titles = titles
 
 
 def name_by_nm_id(nm_id: int | str | None, mapping: Dict[str, str] | None = None) -> str | None:
@@ -198,8 +295,11 @@ _BRAND_WORDS = {
     "kilian","valentino","givenchy","prada","loewe","byredo","zadig","voltaire"
 }
 _WORD_RE = re.compile(r"[a-zA-Zа-яА-ЯёЁ']+", re.UNICODE)
+_NONWORD_RE = re.compile(r"[^A-Za-zА-Яа-яЁё0-9\s]")
+_TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
 
 
+@lru_cache(maxsize=8192)
 def _normalize_title(s: str) -> str:
     s = s.lower()
     s = re.sub(r"\b\d+\s*(ml|мл)\b", "", s)
@@ -207,7 +307,8 @@ def _normalize_title(s: str) -> str:
     return s
 
 
-def _tokens(s: str) -> set[str]:
+@lru_cache(maxsize=8192)
+def _tokens(s: str) -> frozenset[str]:
     toks: list[str] = []
     for w in _WORD_RE.findall(s):
         w = w.strip().lower()
@@ -215,32 +316,88 @@ def _tokens(s: str) -> set[str]:
             continue
         toks.append(w)
     toks = [t for t in toks if t not in _BRAND_WORDS]
-    return set(toks)
+    return frozenset(toks)
+
+
+def _top_titles(query: str, candidates: Sequence[str], k: int) -> List[str]:
+    qn = _normalize_title(query)
+    tq = _tokens(qn)
+    lq = len(qn)
+
+    # дешёвая верхняя граница: жаккар + real_quick_ratio (только длины строк)
+    bounds = []
+    for i, c in enumerate(candidates):
+        cn = _normalize_title(c)
+        tc = _tokens(cn)
+        inter = len(tq & tc) if tq and tc else 0
+        base = 0.6 * (inter / len(tq | tc) if inter else 0.0) + (0.1 if inter else 0.0)
+        total = lq + len(cn)
+        rq = 2.0 * min(lq, len(cn)) / total if total else 1.0
+        bounds.append((base + 0.4 * rq, base, i, cn))
+    bounds.sort(key=lambda x: x[0], reverse=True)
+
+    matcher = SequenceMatcher(None, qn, "")
+    scored: list[tuple[float, int]] = []
+    top: list[float] = []  # мин-куча лучших k оценок по разным ключам
+    seen_keys = set()
+    for bound, base, i, cn in bounds:
+        thr = top[0] if len(top) >= k else -1.0
+        if bound < thr:
+            break
+        matcher.set_seq2(cn)
+        if base + 0.4 * matcher.quick_ratio() < thr:
+            continue
+        score = base + 0.4 * matcher.ratio()
+        scored.append((score, i))
+        key = candidates[i].strip().lower()
+        if key and key not in seen_keys:
+            seen_keys.add(key)
+            if len(top) < k:
+                heapq.heappush(top, score)
+            elif score > top[0]:
+                heapq.heapreplace(top, score)
+    scored.sort(key=lambda x: (-x[0], x[1]))
 
+    result: list[str] = []
+    seen = set()
+    for _, i in scored:
+        t = candidates[i]
+        key = t.strip().lower()
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        result.append(t)
+        if len(result) >= k:
+            break
+    return result
 
-def _score_titles(a: str, b: str) -> float:
-    from difflib import SequenceMatcher
-    an, bn = _normalize_title(a), _normalize_title(b)
-    ta, tb = _tokens(an), _tokens(bn)
-    if not ta or not tb:
-        j = 0.0
-    else:
-        inter = len(ta & tb)
-        union = len(ta | tb)
-        j = inter / union if union else 0.0
-    ratio = SequenceMatcher(None, an, bn).ratio()  # 0..1
-    bonus = 0.1 if (ta & tb) else 0.0
-    return 0.6 * j + 0.4 * ratio + bonus
 
+def _analyze(s: str) -> List[str]:
+    return _TOKEN_RE.findall(_NONWORD_RE.sub(" ", s).lower())
 
-def _clean_series(s: pd.Series) -> pd.Series:
-    return (
-        s.astype(str)
-         .str.replace(r"[^A-Za-zА-Яа-яЁё0-9\s]", " ", regex=True)
-         .str.replace(r"\s+", " ", regex=True)
-         .str.lower()
-         .str.strip()
-    )
+
+def _analyze_series(s: pd.Series) -> List[List[str]]:
+    return [_analyze(str(x)) for x in s.values]
+
+
+def _pretokenized(doc: List[str]) -> List[str]:
+    return doc
+
+
+def _titles_by_rank(idx: np.ndarray, qn: str, k: int) -> List[str]:
+    out: list[str] = []
+    seen = set()
+    for i in idx:
+        if _row_title_norm[i] == qn:
+            continue
+        key = _row_title_lower[i]
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append(_row_titles[i])
+        if len(out) >= k:
+            break
+    return out
 
 
 def similar_titles(query_title: str, catalog_titles: List[str], k: int = 3) -> List[str]:
@@ -252,47 +409,28 @@ def similar_titles(query_title: str, catalog_titles: List[str], k: int = 3) -> L
     assert _df_cache is not None
     assert _vec_cache is not None
     assert _matrix_cache is not None
+    assert _title2rows is not None
 
-    q_mask = _df_cache[SYS_TITLE].astype(str).str.lower().str.strip() == query_title.lower().strip()
-    if q_mask.any():
-        q_desc = _df_cache.loc[q_mask, SYS_DESC].astype(str)
-        if not q_desc.empty and q_desc.iloc[0].strip():
-            vec_q = _vec_cache.transform(_clean_series(q_desc))
-            sims = cosine_similarity(vec_q, _matrix_cache)[0]
+    q_rows = _title2rows.get(query_title.lower().strip())
+    if q_rows:
+        q_row = q_rows[0]
+        if str(_df_cache[SYS_DESC].iat[q_row]).strip():
+            # строка каталога уже векторизована и нормирована — transform не нужен;
+            # берём ровно одну строку (1×V), иначе при дублях названия ravel() склеит N×q столбцов
+            vec_q = _matrix_cache[q_row:q_row + 1]
+            sims = (_matrix_cache @ vec_q.T).toarray()[:, 0]
 
-            idx_all = np.argsort(sims)[::-1]
             qn = _normalize_title(query_title)
-            out: list[str] = []
-            seen = set()
-            for i in idx_all:
-                title_i = str(_df_cache.iloc[i][SYS_TITLE]).strip()
-                if _normalize_title(title_i) == qn:
-                    continue
-                key = title_i.lower()
-                if key in seen:
-                    continue
-                seen.add(key)
-                out.append(title_i)
-                if len(out) >= k:
-                    break
+            m = min(len(sims), max(k * 4, 32))
+            part = np.argpartition(-sims, m - 1)[:m]
+            out = _titles_by_rank(part[np.argsort(-sims[part])], qn, k)
+            if len(out) < k and m < len(sims):
+                out = _titles_by_rank(np.argsort(sims)[::-1], qn, k)
             return out
 
     qn = _normalize_title(query_title)
     candidates = [t for t in catalog_titles if _normalize_title(t) != qn]
-    scored = [(t, _score_titles(query_title, t)) for t in candidates]
-    scored.sort(key=lambda x: x[1], reverse=True)
-
-    result: list[str] = []
-    seen = set()
-    for t, _ in scored:
-        key = t.strip().lower()
-        if not key or key in seen:
-            continue
-        seen.add(key)
-        result.append(t)
-        if len(result) >= k:
-            break
-    return result
+    return _top_titles(query_title, candidates, k)
 
 
 def similar_by_nm_id(nm_id: int | str | None, k: int = 3) -> List[str]:
@@ -3,6 +3,7 @@ from __future__ import annotations
 import logging
 import re
 import time
+from functools import lru_cache
 from types import SimpleNamespace
 from typing import Optional, Tuple, Sequence, List
 
@@ -17,6 +18,7 @@ from google.api_core.exceptions import (
 
 from app.schemas.gemini_schemas import AnswerInput
 from app.core.config import settings
+from app.utils import AdaptiveTokenBucket
 
 log = logging.getLogger("app.clients.gemini")
 
@@ -84,6 +86,10 @@ class _GeminiAdapter:
             system_instruction=PROMPT,
         )
 
+        # квота Gemini на ключ: темп подстраивается по 429, чтобы не упираться в них заранее
+        rps = getattr(settings.api_keys, "GEMINI_RPS", None) or 1.0
+        self.bucket = AdaptiveTokenBucket(capacity=1.0, rate=rps)
+
     def _swap_model(self, new_name: str) -> None:
         self.model_name = _normalize_model_name(new_name)
         self.model = genai.GenerativeModel(
@@ -95,6 +101,7 @@ class _GeminiAdapter:
         attempt = 0
         while True:
             try:
+                self.bucket.acquire()
                 out = self.model.generate_content(prompt_text)
                 text = getattr(out, "text", None)
                 if not text:
@@ -109,6 +116,8 @@ class _GeminiAdapter:
                 if "User location is not supported" in msg:
                     log.warning("Gemini region block: %s (model=%s)", msg, self.model_name)
                     return SimpleNamespace(text="")
+                if isinstance(e, ResourceExhausted):
+                    self.bucket.throttled()
                 attempt += 1
                 delay = _extract_retry_after(msg) or (self.base_sleep * (2 ** attempt))
                 if attempt > self.max_retries:
@@ -143,43 +152,39 @@ class _GeminiAdapter:
                 time.sleep(min(delay, 15.0))
 
 
-_RETRY_IN_RE = re.compile(r"(retry in|retry_after|retry-after)\s*:?[\s=]*([0-9]+(?:\.[0-9]+)?)", re.IGNORECASE)
-_RETRY_SECONDS_BLOCK_RE = re.compile(r"retry_delay\s*\{\s*seconds:\s*([0-9]+)", re.IGNORECASE)
+_RETRY_AFTER_RE = re.compile(
+    r"(?:retry in|retry_after|retry-after)\s*:?[\s=]*(?P<a>[0-9]+(?:\.[0-9]+)?)"
+    r"|retry_delay\s*\{\s*seconds:\s*(?P<b>[0-9]+)",
+    re.IGNORECASE,
+)
 
 
 def _extract_retry_after(err_msg: str) -> Optional[float]:
-    m = _RETRY_IN_RE.search(err_msg or "")
-    if m:
-        try:
-            return float(m.group(2))
-        except Exception:
-            pass
-    m = _RETRY_SECONDS_BLOCK_RE.search(err_msg or "")
-    if m:
-        try:
-            return float(m.group(1))
-        except Exception:
-            pass
-    return None
+    if not err_msg:
+        return None
+    m = _RETRY_AFTER_RE.search(err_msg)
+    if not m:
+        return None
+    try:
+        return float(m.group("a") or m.group("b"))
+    except Exception:
+        return None
 
 
 def _dedup_keep_order(items: Sequence[str], limit: int | None = None) -> List[str]:
-    seen = set()
-    out: List[str] = []
-    for x in items or []:
+    if not items:
+        return []
+    out: dict[str, str] = {}
+    for x in items:
         if not isinstance(x, str):
             continue
         t = x.strip()
         if not t:
             continue
-        key = t.lower()
-        if key in seen:
-            continue
-        seen.add(key)
-        out.append(t)
+        out.setdefault(t.lower(), t)
         if limit is not None and len(out) >= limit:
             break
-    return out
+    return list(out.values())
 
 
 def _join_block(title: str, lines: Sequence[str]) -> str:
@@ -189,6 +194,15 @@ def _join_block(title: str, lines: Sequence[str]) -> str:
     return f"{title}:\n" + "\n".join(f"- {t}" for t in data)
 
 
+@lru_cache(maxsize=8)
+def _available_block(titles: Tuple[str, ...]) -> str:
+    return _join_block("ДОСТУПНЫЕ АРОМАТЫ", titles)
+
+
+_TITLE_DASH_RE = re.compile(r"\s+—\s+| - ")
+_NUM_LINE_RE = re.compile(r"[🔹•\-\s]*\d+[\.]*\s*")
+
+
 def _extract_title_from_bullet(line: str) -> Optional[str]:
     s = line.strip()
     if not s.startswith(("🔹", "•", "-")):
@@ -196,7 +210,7 @@ def _extract_title_from_bullet(line: str) -> Optional[str]:
     s = s.lstrip("🔹•- ").strip()
     if not s:
         return None
-    parts = re.split(r"\s+—\s+| - ", s, maxsplit=1)
+    parts = _TITLE_DASH_RE.split(s, maxsplit=1)
     title = (parts[0] if parts else s).strip().strip("*")
     return title or None
 
@@ -316,7 +330,7 @@ def make_answer(
             return "—"
         return str(val).strip()
 
-    available_block = _join_block("ДОСТУПНЫЕ АРОМАТЫ", available_titles or [])
+    available_block = _available_block(tuple(available_titles or ()))
     pref = _dedup_keep_order(preferred_titles or [], limit=5)
     preferred_block = "\n\n" + _join_block("ПРИОРИТЕТНЫЕ АЛЬТЕРНАТИВЫ (используй в первую очередь)", pref) if pref else ""
     excl = _dedup_keep_order(exclude_titles or [], limit=10)
@@ -346,7 +360,7 @@ def make_answer(
             log.warning("Gemini вернул пустой ответ", extra={"input": str(getattr(inp, 'text', ''))[:160]})
             return None, None
 
-        raw_lines = [line for line in text.splitlines() if not re.fullmatch(r"[🔹•\-\s]*\d+[\.]*\s*", line.strip())]
+        raw_lines = [line for line in text.splitlines() if not _NUM_LINE_RE.fullmatch(line)]
         exclude_lc = {t.lower() for t in (exclude_titles or []) if isinstance(t, str)}
         seen_titles = set()
         filtered_lines: List[str] = []
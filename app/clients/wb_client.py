@@ -1,23 +1,41 @@
 from __future__ import annotations
 
+import itertools
 import logging
-import time
+import threading
 from typing import Any
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from app.core.config import settings
-from app.utils import rate
+from app.utils import wb_bucket, with_retry
 
 log = logging.getLogger("app.clients.wb_client")
 
+# POST ответа не идемпотентен: 500/502/504 могли прийти уже после сохранения на стороне WB,
+# поэтому запись повторяем только на явный отказ без обработки
+_WRITE_RETRY_STATUSES = frozenset({429, 503})
+
 
 class WBClient:
     def __init__(self, token: str | None = None, base: str | None = None) -> None:
         self.base = (base or settings.api_keys.WB_BASE_URL).rstrip("/")
         self.s = requests.Session()
-        self.s.headers.update({"Authorization": f"{token or settings.api_keys.WB_TOKEN}"})
 
+        # WB_TOKEN может содержать несколько ключей через запятую: квота WB на ключ,
+        # поэтому запросы раздаём по кругу, а Authorization ставим на каждый запрос
+        raw = token or settings.api_keys.WB_TOKEN or ""
+        self._tokens = [t.strip() for t in raw.split(",") if t.strip()] or [""]
+        self._rr = itertools.cycle(self._tokens)
+        self._rr_lock = threading.Lock()
+
+        # повторы делает with_retry на уровне методов, адаптер только держит пул
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0)
+        self.s.mount("https://", adapter)
+        self.s.mount("http://", adapter)
+
+    @with_retry()
     def list_feedbacks_archive(
         self,
         *,
@@ -27,7 +45,7 @@ class WBClient:
         nm_id: int | None = None,
         timeout: int = 30,
     ) -> dict[str, Any]:
-        rate.wait()
+        headers = self._auth("read")
         take = max(1, min(int(take), 5000))
         skip = max(0, int(skip))
 
@@ -40,58 +58,41 @@ class WBClient:
             params["nmId"] = int(nm_id)
 
         url = f"{self.base}/feedbacks/archive"
-        backoff = 1.0
-
-        for attempt in range(5):
-            resp = self.s.get(url, params=params, timeout=timeout)
-            if resp.status_code == 204:
-                return {}
-
-            if resp.status_code in (429, 500, 502, 503, 504):
-                log.warning(
-                    "WB archive rate/5xx, retrying",
-                    extra={
-                        "url": url,
-                        "status": resp.status_code,
-                        "params": params,
-                        "attempt": attempt + 1,
-                    },
-                )
-                time.sleep(backoff)
-                backoff = min(backoff * 2, 16)
-                continue
 
-            try:
-                resp.raise_for_status()
-            except requests.HTTPError as e:
-                self._log_http_error("WB list_feedbacks_archive failed", url, params, resp, e)
-                raise
+        resp = self.s.get(url, params=params, headers=headers, timeout=timeout)
+        if resp.status_code == 204:
+            return {}
 
-            return resp.json() or {}
+        try:
+            resp.raise_for_status()
+        except requests.HTTPError as e:
+            self._log_http_error("WB list_feedbacks_archive failed", url, params, resp, e)
+            raise
 
-        resp.raise_for_status()
-        return {}
+        return resp.json() or {}
 
+    @with_retry()
     def list_feedbacks(self, *, is_answered: bool, take: int, skip: int) -> dict[str, Any]:
-        rate.wait()
+        headers = self._auth("read")
         params = {"isAnswered": str(is_answered).lower(), "take": take, "skip": skip}
-        resp = self.s.get(f"{self.base}/feedbacks", params=params, timeout=30)
+        resp = self.s.get(f"{self.base}/feedbacks", params=params, headers=headers, timeout=30)
         resp.raise_for_status()
         return resp.json()
 
     def list_questions(self, *, is_answered: bool, take: int, skip: int) -> dict[str, Any]:
-        rate.wait()
+        headers = self._auth("read")
         params = {"isAnswered": str(is_answered).lower(), "take": take, "skip": skip}
-        resp = self.s.get(f"{self.base}/questions", params=params, timeout=30)
+        resp = self.s.get(f"{self.base}/questions", params=params, headers=headers, timeout=30)
         resp.raise_for_status()
         return resp.json()
 
+    @with_retry(codes=_WRITE_RETRY_STATUSES)
     def send_feedback_answer(self, feedback_id: int | str, text: str) -> dict[str, Any]:
-        rate.wait()
+        headers = self._auth("write")
         payload = {"id": str(feedback_id), "text": text}
         url = f"{self.base}/feedbacks/answer"
 
-        resp = self.s.post(url, json=payload, timeout=30)
+        resp = self.s.post(url, json=payload, headers=headers, timeout=30)
         try:
             resp.raise_for_status()
         except requests.HTTPError as e:
@@ -101,11 +102,11 @@ class WBClient:
         return resp.json() if resp.content else {"ok": True}
 
     def send_question_answer(self, question_id: int | str, text: str) -> dict[str, Any]:
-        rate.wait()
+        headers = self._auth("write")
         url = f"{self.base}/questions"
 
         payload_a = {"id": str(question_id), "state": "wbRu", "answer": {"text": text}}
-        resp = self.s.patch(url, json=payload_a, timeout=30)
+        resp = self.s.patch(url, json=payload_a, headers=headers, timeout=30)
         if 200 <= resp.status_code < 300:
             return resp.json() if resp.content else {"ok": True}
 
@@ -119,7 +120,7 @@ class WBClient:
             "Empty state" in err_text or "Неправильный текст ответа" in err_text
         ):
             payload_b = {"id": str(question_id), "state": "wbRu", "text": text}
-            resp_b = self.s.patch(url, json=payload_b, timeout=30)
+            resp_b = self.s.patch(url, json=payload_b, headers=headers, timeout=30)
             if 200 <= resp_b.status_code < 300:
                 return resp_b.json() if resp_b.content else {"ok": True}
             try:
@@ -137,11 +138,11 @@ class WBClient:
         return resp.json() if resp.content else {"ok": True}
 
     def reject_question(self, question_id: int | str) -> dict[str, Any]:
-        rate.wait()
+        headers = self._auth("write")
         url = f"{self.base}/questions"
         payload = {"id": str(question_id), "state": "none"}
 
-        resp = self.s.patch(url, json=payload, timeout=30)
+        resp = self.s.patch(url, json=payload, headers=headers, timeout=30)
         try:
             resp.raise_for_status()
         except requests.HTTPError as e:
@@ -150,6 +151,12 @@ class WBClient:
 
         return resp.json() if resp.content else {"ok": True}
 
+    def _auth(self, kind: str) -> dict[str, str]:
+        with self._rr_lock:
+            token = next(self._rr)
+        wb_bucket(kind, token).acquire()
+        return {"Authorization": token}
+
     def _log_http_error(
         self,
         msg: str,
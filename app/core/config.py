@@ -28,6 +28,7 @@ class APISettings(BaseModel):
     WB_BASE_URL: str = "https://feedbacks-api.wildberries.ru/api/v1"
     GEMINI_TOKEN: str | None = None
     GEMINI_MODEL: str | None = "gemini-2.5-flash"
+    GEMINI_RPS: float = 1.0
     TAKE: int = 500
     POLL_INTERVAL_SEC: int = 30
 
@@ -4,17 +4,35 @@ import logging
 from logging import LogRecord
 import os
 
+_EXTRA_KEYS = ("event", "ingest", "generated", "sent", "wb", "retry_after", "sleep_sec")
+_MISSING = object()
+_TS_FMT = "%Y-%m-%dT%H:%M:%S%z"
+
+
 class JSONFormatter(logging.Formatter):
+    # (секунда, строка): strftime пересчитываем только при смене секунды
+    _ts_cache: tuple[int, str] = (-1, "")
+
+    def _ts(self, record: LogRecord) -> str:
+        sec = int(record.created)
+        cached_sec, cached = self._ts_cache
+        if cached_sec != sec:
+            cached = self.formatTime(record, _TS_FMT)
+            self._ts_cache = (sec, cached)
+        return cached
+
     def format(self, record: LogRecord) -> str:
         base = {
-            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+            "ts": self._ts(record),
             "lvl": record.levelname,
             "name": record.name,
             "msg": record.getMessage(),
         }
-        for key in ("event", "ingest", "generated", "sent", "wb", "retry_after", "sleep_sec"):
-            if hasattr(record, key):
-                base[key] = getattr(record, key)
+        attrs = record.__dict__
+        for key in _EXTRA_KEYS:
+            val = attrs.get(key, _MISSING)
+            if val is not _MISSING:
+                base[key] = val
         if record.exc_info:
             base["exc"] = self.formatException(record.exc_info)
         return json.dumps(base, ensure_ascii=False)
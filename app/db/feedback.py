@@ -1,6 +1,6 @@
 from typing import Optional
 
-from sqlalchemy import String, Integer
+from sqlalchemy import String, Integer, Index, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .mixins import TimeStampMixin, CommonMixin
@@ -8,6 +8,17 @@ from .base import Base
 
 
 class Feedback(CommonMixin, TimeStampMixin, Base):
+    # частичные индексы под выборки generate_answers / send_to_wb
+    __table_args__ = (
+        Index(
+            "ix_feedbacks_loaded_5",
+            "id",
+            postgresql_where=text("status = 'loaded' AND product_valuation = 5"),
+        ),
+        Index("ix_feedbacks_generated", "id", postgresql_where=text("status = 'generated'")),
+        Index("ix_feedbacks_failed", "id", postgresql_where=text("status = 'failed'")),
+    )
+
     username: Mapped[Optional[str]] = mapped_column(
         String(128),
         nullable=True,
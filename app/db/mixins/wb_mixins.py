@@ -24,6 +24,6 @@ class CommonMixin:
         nullable=False,
     )
     status: Mapped[Status] = mapped_column(
-        Enum(Status), index=True, default=Status.loaded
+        Enum(Status), default=Status.loaded
     )
     answer_text: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
@@ -1,6 +1,12 @@
+from sqlalchemy import Index, text
+
 from .mixins import TimeStampMixin, CommonMixin
 from .base import Base
 
 
 class Question(CommonMixin, TimeStampMixin, Base):
-    pass
+    __table_args__ = (
+        Index("ix_questions_loaded", "id", postgresql_where=text("status = 'loaded'")),
+        Index("ix_questions_generated", "id", postgresql_where=text("status = 'generated'")),
+        Index("ix_questions_failed", "id", postgresql_where=text("status = 'failed'")),
+    )
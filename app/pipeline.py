@@ -3,11 +3,15 @@ from __future__ import annotations
 import logging
 import re
 import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
-from typing import Tuple, Optional
+from functools import lru_cache
+from typing import Any, Callable, Iterator, Tuple, Optional
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, load_only
 
 from app.db import Feedback, Question, Status
 from app.core.config import settings
@@ -19,6 +23,25 @@ log = logging.getLogger("app.pipeline")
 client = WBClient()
 _model = None
 
+# общий пустой dict для цепочек .get() по ответам WB; только на чтение
+_EMPTY: dict[str, Any] = {}
+
+# сколько строк копим до commit в generate_answers/send_to_wb
+_COMMIT_BATCH = 50
+# параллельные POST ответов в WB
+_SEND_WORKERS = 4
+
+# конфиг читаем один раз при импорте
+_TAKE = settings.api_keys.TAKE
+_ARCHIVE_TAKE = min(int(getattr(settings.api_keys, "TAKE", 1000) or 1000), 5000)
+_ARCHIVE_WINDOW = timedelta(days=7)
+_UTC = timezone.utc
+
+
+def _default_client() -> WBClient:
+    # общий клиент модуля: один Session и один пул соединений на весь процесс
+    return client
+
 
 def ensure_model():
     global _model
@@ -26,96 +49,142 @@ def ensure_model():
         _model = get_model()
 
 
+# date, hms, frac, tz
 _ISO_RE = re.compile(
-    r"^(?P<date>\d{4}-\d{2}-\d{2})T"
-    r"(?P<hms>\d{2}:\d{2}:\d{2})"
-    r"(?:\.(?P<frac>\d+))?"
-    r"(?P<tz>Z|[+\-]\d{2}:\d{2})?$"
+    r"(\d{4}-\d{2}-\d{2})T"
+    r"(\d{2}:\d{2}:\d{2})"
+    r"(?:\.(\d+))?"
+    r"(Z|[+\-]\d{2}:\d{2})?"
 )
 
+_FROMISO = datetime.fromisoformat
+try:
+    # 3.11+: fromisoformat сам понимает Z и дробную часть любой длины
+    _FROMISO("2024-01-01T00:00:00.1234567Z")
+    _FAST_ISO = True
+except ValueError:
+    _FAST_ISO = False
 
+
+@lru_cache(maxsize=64)
+def _tz(s: str) -> timezone:
+    if s == "Z":
+        return _UTC
+    sign = -1 if s[0] == "-" else 1
+    return timezone(sign * timedelta(hours=int(s[1:3]), minutes=int(s[4:6])))
+
+
+# в странице архива даты часто повторяются, плюс бинпоиск по границе парсит те же строки
+@lru_cache(maxsize=2048)
 def _iso_to_dt(val: str) -> datetime:
     if not val:
         raise ValueError("empty datetime string")
-    m = _ISO_RE.match(val)
+    if _FAST_ISO:
+        try:
+            return _FROMISO(val)
+        except ValueError:
+            pass
+    m = _ISO_RE.fullmatch(val)
     if not m:
-        return datetime.fromisoformat(val.replace("Z", "+00:00"))
-
-    date = m.group("date")
-    hms = m.group("hms")
-    frac = m.group("frac") or ""
-    tz = m.group("tz") or ""
+        return _FROMISO(val.replace("Z", "+00:00"))
 
-    if tz == "Z":
-        tz = "+00:00"
+    date, hms, frac, tz = m.groups()
 
     if frac:
-        frac = (frac[:6]).ljust(6, "0")
-        iso = f"{date}T{hms}.{frac}{tz}"
+        dt = _FROMISO(f"{date}T{hms}.{frac[:6].ljust(6, '0')}")
     else:
-        iso = f"{date}T{hms}{tz}"
+        dt = _FROMISO(f"{date}T{hms}")
 
-    return datetime.fromisoformat(iso)
+    return dt.replace(tzinfo=_tz(tz)) if tz else dt
 
 
 def _surrogate_feedback_text(text: str | None, rating: int | None, username: str | None) -> str:
-    if text and text.strip():
-        return text.strip()
-    parts = ["Отзыв без текста."]
-    if rating is not None:
-        parts.append(f"Оценка: {rating}/5.")
-    if username:
-        parts.append(f"Покупатель: {username}.")
-    return " ".join(parts)
+    stripped = text.strip() if text else ""
+    if stripped:
+        return stripped
+    rating_part = f" Оценка: {rating}/5." if rating is not None else ""
+    user_part = f" Покупатель: {username}." if username else ""
+    return f"Отзыв без текста.{rating_part}{user_part}"
 
 
 def _surrogate_question_text(text: str | None) -> str:
-    if text and text.strip():
-        return text.strip()
-    return "Вопрос без текста."
+    stripped = text.strip() if text else ""
+    return stripped or "Вопрос без текста."
+
+
+def _iter_pages(
+    fetch: Callable[[int], dict[str, Any]],
+    key: str,
+    stop: Callable[[list[dict[str, Any]]], bool] | None = None,
+) -> Iterator[list[dict[str, Any]]]:
+    # следующая страница качается в фоне, пока вызывающий код пишет текущую в БД;
+    # stop(items) проверяется до запроса следующей, чтобы не качать лишнюю страницу
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        skip = 0
+        pending = ex.submit(fetch, skip)
+        while True:
+            data = pending.result() or _EMPTY
+            items = (data.get("data") or _EMPTY).get(key) or []
+            if not items:
+                return
+            if stop is not None and stop(items):
+                yield items
+                return
+            skip += len(items)
+            pending = ex.submit(fetch, skip)
+            yield items
+
+
+def _insert_new(session: Session, model: type[Feedback] | type[Question], rows: list[dict[str, Any]]) -> int:
+    # дубли отсекает уникальный индекс по wb_id, RETURNING отдаёт только реально вставленные
+    stmt = (
+        pg_insert(model)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["wb_id"])
+        .returning(model.wb_id)
+    )
+    return len(session.scalars(stmt).all())
 
 
 def ingest_feedbacks(session: Session) -> int:
-    skip = 0
     inserted = 0
-    take = settings.api_keys.TAKE
+    now = datetime.now(_UTC)
+    take = _TAKE
 
-    while True:
-        data = client.list_feedbacks(is_answered=False, take=take, skip=skip) or {}
-        items = (data.get("data") or {}).get("feedbacks") or []
-        if not items:
-            break
+    pages = _iter_pages(
+        lambda skip: client.list_feedbacks(is_answered=False, take=take, skip=skip),
+        "feedbacks",
+    )
+    for items in pages:
+        seen: set[str] = set()
+        rows: list[dict[str, Any]] = []
 
         for f in items:
             wb_id = f.get("id")
-            if not wb_id:
+            if not wb_id or str(wb_id) in seen:
                 continue
+            seen.add(str(wb_id))
 
-            exists = session.scalar(select(Feedback).where(Feedback.wb_id == wb_id))
-            if exists:
-                continue
-
-            pd = f.get("productDetails") or {}
+            pd = f.get("productDetails") or _EMPTY
             product_name = (
                 pd.get("productName") or pd.get("name") or ""
             )
             created_raw = f.get("createdDate")
 
-            fb = Feedback(
+            rows.append(dict(
                 wb_id=wb_id,
                 nm_id=pd.get("nmId"),
                 product_name=product_name,
-                text=f.get("text") or "",
-                created_at_wb=_iso_to_dt(created_raw) if created_raw else datetime.utcnow(),
+                text=(f.get("text") or "").strip(),
+                created_at_wb=_iso_to_dt(created_raw) if created_raw else now,
                 username=f.get("userName"),
                 product_valuation=f.get("productValuation"),
                 status=Status.loaded,
-            )
-            session.add(fb)
-            inserted += 1
+            ))
 
-        session.commit()
-        skip += take
+        if rows:
+            inserted += _insert_new(session, Feedback, rows)
+            session.commit()
 
     log.info(
         "Inserted feedbacks: %s",
@@ -126,40 +195,38 @@ def ingest_feedbacks(session: Session) -> int:
 
 
 def ingest_questions(session: Session) -> int:
-    skip = 0
     inserted = 0
-    take = settings.api_keys.TAKE
+    now = datetime.now(_UTC)
+    take = _TAKE
 
-    while True:
-        data = client.list_questions(is_answered=False, take=take, skip=skip) or {}
-        items = (data.get("data") or {}).get("questions") or []
-        if not items:
-            break
+    pages = _iter_pages(
+        lambda skip: client.list_questions(is_answered=False, take=take, skip=skip),
+        "questions",
+    )
+    for items in pages:
+        seen: set[str] = set()
+        rows: list[dict[str, Any]] = []
 
         for q in items:
             wb_id = q.get("id")
-            if not wb_id:
-                continue
-
-            exists = session.scalar(select(Question).where(Question.wb_id == wb_id))
-            if exists:
+            if not wb_id or str(wb_id) in seen:
                 continue
+            seen.add(str(wb_id))
 
-            pd = q.get("productDetails") or {}
+            pd = q.get("productDetails") or _EMPTY
             created_raw = q.get("createdDate")
 
-            qo = Question(
+            rows.append(dict(
                 wb_id=wb_id,
                 nm_id=pd.get("nmId"),
-                text=q.get("text") or "",
-                created_at_wb=_iso_to_dt(created_raw) if created_raw else datetime.utcnow(),
+                text=(q.get("text") or "").strip(),
+                created_at_wb=_iso_to_dt(created_raw) if created_raw else now,
                 status=Status.loaded,
-            )
-            session.add(qo)
-            inserted += 1
+            ))
 
-        session.commit()
-        skip += take
+        if rows:
+            inserted += _insert_new(session, Question, rows)
+            session.commit()
 
     log.info(
         "Ingested questions: %s",
@@ -169,28 +236,90 @@ def ingest_questions(session: Session) -> int:
     return inserted
 
 
+TRIGGERS = ("альтернатива", "похож", "заменить", "совет", "рекоменд", "что взять", "какой")
+_TRIGGERS_RE = re.compile("|".join(map(re.escape, TRIGGERS)))
+
+
+def _need_recommendation(txt: str) -> bool:
+    return _TRIGGERS_RE.search((txt or "").lower()) is not None
+
+
+def _iter_by_id(session: Session, model, stmt, *, page: int = _COMMIT_BATCH) -> Iterator[Any]:
+    # keyset по id: страница берётся FOR UPDATE SKIP LOCKED целиком в память и коммитится
+    # перед следующей, так несколько generate.py (каждый со своим Gemini-ключом)
+    # не берут одни и те же строки
+    stmt = stmt.with_for_update(skip_locked=True)
+    last_id = 0
+    while True:
+        batch = session.scalars(
+            stmt.where(model.id > last_id).order_by(model.id).limit(page)
+        ).all()
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1].id
+        session.commit()
+
+
+def _has_rows(session: Session, *where) -> bool:
+    return bool(session.scalar(select(exists().where(*where))))
+
+
+_catalog: Tuple[dict[str, str], list[str]] | None = None
+
+
+def load_catalog() -> Tuple[dict[str, str], list[str]]:
+    # пул названий сортируется один раз на снимок каталога, а не на каждый проход
+    global _catalog
+    available_map, _ = load_available()
+    if _catalog is None or _catalog[0] is not available_map:
+        _catalog = (available_map, titles_pool(available_map))
+    return _catalog
+
+
 def generate_answers(session: Session) -> Tuple[int, int, Optional[float]]:
+    # пустой опрос не должен поднимать модель и каталог
+    if not (
+        _has_rows(session, Feedback.status == Status.loaded, Feedback.product_valuation == 5)
+        or _has_rows(session, Question.status == Status.loaded)
+    ):
+        return 0, 0, None
+
     ensure_model()
 
     made_fb = 0
     made_q = 0
     retry_after_max: Optional[float] = None
 
-    available_map, available_titles = load_available()
-    available_titles_list = titles_pool(available_map)
+    # каталог поднимается только когда есть что генерировать; load_catalog мемоизирован
+    available_map, available_titles_list = load_catalog()
 
-    # --- FEEDBACKS ---
-    for fb in session.scalars(select(Feedback).where(Feedback.status == Status.loaded)):
-        if (fb.product_valuation is None) or (int(fb.product_valuation) != 5):
-            continue
+    # у одного товара много отзывов: похожие названия считаем один раз на товар
+    preferred_cache: dict[str, list[str]] = {}
+
+    def _preferred(title: str) -> list[str]:
+        pref = preferred_cache.get(title)
+        if pref is None:
+            pref = preferred_cache[title] = similar_titles(title, available_titles_list, k=3)
+        return pref
 
+    # --- FEEDBACKS ---
+    fb_stmt = (
+        select(Feedback)
+        .where(Feedback.status == Status.loaded, Feedback.product_valuation == 5)
+        .options(load_only(
+            Feedback.id, Feedback.wb_id, Feedback.text, Feedback.product_name,
+            Feedback.product_valuation, Feedback.username, Feedback.nm_id,
+        ))
+    )
+    for fb in _iter_by_id(session, Feedback, fb_stmt):
         start_time = time.time()
 
         product_title = fb.product_name or ""
         if not product_title and fb.nm_id is not None:
             product_title = name_by_nm_id(fb.nm_id, available_map) or ""
 
-        preferred = similar_titles(product_title, available_titles_list, k=3) if product_title else []
+        preferred = _preferred(product_title) if product_title else []
 
         text, retry_after = make_answer(
             _model,
@@ -218,7 +347,6 @@ def generate_answers(session: Session) -> Tuple[int, int, Optional[float]]:
         fb.answer_text = text
         fb.status = Status.generated
         session.add(fb)
-        session.commit()
         made_fb += 1
 
         log.info(
@@ -228,16 +356,16 @@ def generate_answers(session: Session) -> Tuple[int, int, Optional[float]]:
         )
 
     if retry_after_max:
+        session.commit()
         return made_fb, made_q, retry_after_max
 
     # --- QUESTIONS ---
-    TRIGGERS = ("альтернатива", "похож", "заменить", "совет", "рекоменд", "что взять", "какой")
-
-    def _need_recommendation(txt: str) -> bool:
-        t = (txt or "").lower()
-        return any(w in t for w in TRIGGERS)
-
-    for q in session.scalars(select(Question).where(Question.status == Status.loaded)):
+    q_stmt = (
+        select(Question)
+        .where(Question.status == Status.loaded)
+        .options(load_only(Question.id, Question.wb_id, Question.text, Question.nm_id))
+    )
+    for q in _iter_by_id(session, Question, q_stmt):
         start_time = time.time()
         text_in = _surrogate_question_text(q.text)
 
@@ -251,7 +379,7 @@ def generate_answers(session: Session) -> Tuple[int, int, Optional[float]]:
                 exclude = [product_title]
 
         if _need_recommendation(text_in):
-            preferred = similar_titles(product_title, available_titles_list, k=3)
+            preferred = _preferred(product_title)
 
         text, retry_after = make_answer(
             _model,
@@ -273,7 +401,6 @@ def generate_answers(session: Session) -> Tuple[int, int, Optional[float]]:
         q.answer_text = text
         q.status = Status.generated
         session.add(q)
-        session.commit()
         made_q += 1
 
         log.info(
@@ -282,30 +409,84 @@ def generate_answers(session: Session) -> Tuple[int, int, Optional[float]]:
             extra={"event": "question_generated", "elapsed": duration},
         )
 
+    session.commit()
     return made_fb, made_q, retry_after_max
 
 
 # --- Отправка в WB ---
 
+def _flush_statuses(session: Session, model, sent_ids: list[int], failed_ids: list[int]) -> None:
+    for status, ids in ((Status.sent, sent_ids), (Status.failed, failed_ids)):
+        if ids:
+            session.execute(
+                update(model).where(model.id.in_(ids)).values(status=status),
+                execution_options={"synchronize_session": False},
+            )
+    session.commit()
+    # чистим только после commit: при ошибке id остаются для повторной записи
+    sent_ids.clear()
+    failed_ids.clear()
+
+
 def send_to_wb(session: Session) -> tuple[int, int]:
     sent_fb = 0
     # sent_q = 0
 
-    for fb in session.scalars(select(Feedback).where(Feedback.status == Status.generated)):
-        if not (fb.answer_text and fb.answer_text.strip()):
-            fb.status = Status.failed
-            session.commit()
-            continue
-
+    rows = session.execute(
+        select(Feedback.id, Feedback.wb_id, Feedback.answer_text)
+        .where(Feedback.status == Status.generated)
+    ).all()
+
+    sent_ids: list[int] = []
+    failed_ids: list[int] = []
+    to_send: list[tuple[int, str, str]] = []
+    for fb_id, wb_id, answer_text in rows:
+        if answer_text and answer_text.strip():
+            to_send.append((fb_id, wb_id, answer_text))
+        else:
+            failed_ids.append(fb_id)
+
+    def _record(fut, fb_id: int, wb_id: str) -> None:
+        nonlocal sent_fb
         try:
-            client.send_feedback_answer(fb.wb_id, fb.answer_text)
-            fb.status = Status.sent
-            session.commit()
+            fut.result()
+            sent_ids.append(fb_id)
             sent_fb += 1
         except Exception as e:
-            log.warning("Failed to send feedback %s: %s", fb.wb_id, e)
-            fb.status = Status.failed
-            session.commit()
+            log.warning("Failed to send feedback %s: %s", wb_id, e)
+            failed_ids.append(fb_id)
+
+    # темп отправки держат ведра wb_bucket внутри send_feedback_answer
+    ex = ThreadPoolExecutor(max_workers=_SEND_WORKERS)
+    futures = {
+        ex.submit(client.send_feedback_answer, wb_id, answer_text): (fb_id, wb_id)
+        for fb_id, wb_id, answer_text in to_send
+    }
+    pending = set(futures)
+    try:
+        for fut in as_completed(futures):
+            pending.discard(fut)
+            _record(fut, *futures[fut])
+            if len(sent_ids) + len(failed_ids) >= _COMMIT_BATCH:
+                _flush_statuses(session, Feedback, sent_ids, failed_ids)
+    except BaseException:
+        # очередь не досылаем: без сохранённого статуса эти ответы уйдут повторно
+        ex.shutdown(wait=True, cancel_futures=True)
+        for fut in pending:
+            if not fut.cancelled():
+                _record(fut, *futures[fut])
+        session.rollback()
+        try:
+            _flush_statuses(session, Feedback, sent_ids, failed_ids)
+        except Exception:
+            session.rollback()
+            log.exception(
+                "Failed to save statuses after send error",
+                extra={"event": "send_statuses_lost", "sent": len(sent_ids)},
+            )
+        raise
+    ex.shutdown(wait=True)
+    _flush_statuses(session, Feedback, sent_ids, failed_ids)
 
     # если захочешь вернуть вопросы – раскомментируешь блок ниже
     # for q in session.scalars(select(Question).where(Question.status == Status.generated)):
@@ -326,32 +507,48 @@ def send_to_wb(session: Session) -> tuple[int, int]:
     return sent_fb, 0
 
 
+def _older_than(f: dict, cutoff: datetime) -> bool:
+    created_raw = f.get("createdDate")
+    if not created_raw:
+        return False
+    try:
+        created_dt = _iso_to_dt(created_raw)
+    except Exception:
+        return False
+    if created_dt.tzinfo is None:
+        created_dt = created_dt.replace(tzinfo=_UTC)
+    return created_dt < cutoff
+
+
 def ingest_feedbacks_archive(
     session: Session,
     *,
     order: str | None = "dateDesc",
     client: WBClient | None = None,
 ) -> int:
-    client = client or WBClient()
+    client = client or _default_client()
     inserted = 0
-    skip = 0
-
-    take_cfg = getattr(settings.api_keys, "TAKE", 1000) or 1000
-    take = min(int(take_cfg), 5000)
 
-    cutoff = datetime.now(timezone.utc) - timedelta(days=7)
+    take = _ARCHIVE_TAKE
+    cutoff = datetime.now(_UTC) - _ARCHIVE_WINDOW
 
-    while True:
-        data = client.list_feedbacks_archive(take=take, skip=skip, order=order) or {}
-        items = (data.get("data") or {}).get("feedbacks") or []
-        if not items:
-            break
+    by_date_desc = order == "dateDesc"
+    pages = _iter_pages(
+        lambda skip: client.list_feedbacks_archive(take=take, skip=skip, order=order),
+        "feedbacks",
+        # при dateDesc страница с хвостом старше cutoff — последняя
+        stop=(lambda items: _older_than(items[-1], cutoff)) if by_date_desc else None,
+    )
+    for items in pages:
+        if by_date_desc:
+            # страница отсортирована по убыванию даты: хвост старше cutoff отрезаем бинпоиском
+            items = items[:bisect_left(items, True, key=lambda f: _older_than(f, cutoff))]
 
-        page_all_older = True
+        seen: set[str] = set()
+        rows: list[dict[str, Any]] = []
 
         for f in items:
-            ans_text = ((f.get("answer") or {}).get("text") or "").strip()
-            if ans_text:
+            if (ans_text := (f.get("answer") or _EMPTY).get("text")) and ans_text.strip():
                 continue
 
             created_raw = f.get("createdDate")
@@ -363,45 +560,39 @@ def ingest_feedbacks_archive(
             except Exception:
                 continue
 
-            if created_dt.tzinfo is None:
-                created_dt = created_dt.replace(tzinfo=timezone.utc)
-            else:
-                created_dt = created_dt.astimezone(timezone.utc)
+            tz = created_dt.tzinfo
+            if tz is None:
+                created_dt = created_dt.replace(tzinfo=_UTC)
+            elif tz is not _UTC:
+                created_dt = created_dt.astimezone(_UTC)
 
             if created_dt < cutoff:
                 continue
-            else:
-                page_all_older = False
 
             wb_id = f.get("id")
-            if not wb_id:
-                continue
-
-            exists = session.scalar(select(Feedback).where(Feedback.wb_id == wb_id))
-            if exists:
+            if not wb_id or str(wb_id) in seen:
                 continue
+            seen.add(str(wb_id))
 
-            pd = f.get("productDetails") or {}
+            pd = f.get("productDetails") or _EMPTY
             product_name = pd.get("productName") or pd.get("name") or ""
 
-            fb = Feedback(
+            rows.append(dict(
                 wb_id=str(wb_id),
                 nm_id=pd.get("nmId"),
                 product_name=product_name,
-                text=f.get("text") or "",
+                text=(f.get("text") or "").strip(),
                 created_at_wb=created_dt,
                 username=f.get("userName"),
                 product_valuation=f.get("productValuation"),
                 status=Status.loaded,
-            )
-            session.add(fb)
-            inserted += 1
+            ))
 
-        session.commit()
-        skip += len(items)
+        if rows:
+            inserted += _insert_new(session, Feedback, rows)
+            session.commit()
 
-        if order == "dateDesc" and page_all_older:
-            break
+    _iso_to_dt.cache_clear()
 
     log.info(
         "Inserted archive feedbacks (unanswered, last 7d): %s",
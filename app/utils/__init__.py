@@ -1,7 +1,11 @@
 from .case_converter import camel_to_snake_case
-from .rate_limiter import rate
+from .retry import with_retry
+from .token_bucket import AdaptiveTokenBucket, TokenBucket, wb_bucket
 
 __all__ = (
     "camel_to_snake_case",
-    "rate",
+    "with_retry",
+    "TokenBucket",
+    "AdaptiveTokenBucket",
+    "wb_bucket",
 )
@@ -1,17 +1,10 @@
-def camel_to_snake_case(tablename: str) -> str:
-    chars = []
-
-    for idx, char in enumerate(tablename):
-        if idx and char.isupper():
-            nxt_idx = idx + 1
+import re
+from functools import lru_cache
 
-            flag = nxt_idx >= len(tablename) or tablename[nxt_idx].isupper()
-            prev_char = tablename[nxt_idx - 1]
+# "_" перед заглавной (кроме первой буквы), за которой идёт не заглавная
+_CAMEL_RE = re.compile(r"(?<=.)(?=[A-Z][^A-Z])", re.S)
 
-            if prev_char.isupper() and flag:
-                pass
-            else:
-                chars.append("_")
-        chars.append(char)
 
-    return "".join(chars)
+@lru_cache(maxsize=512)
+def camel_to_snake_case(tablename: str) -> str:
+    return _CAMEL_RE.sub("_", tablename)
@@ -3,8 +3,8 @@ import argparse
 import logging
 
 from app.core.logger import setup_logging
-from app.db import get_session
-from sqlalchemy import text
+from app.db import Feedback, Question, Status, get_session
+from sqlalchemy import update
 
 log = logging.getLogger("tools.requeue_failed")
 
@@ -20,19 +20,20 @@ def main() -> int:
     setup_logging()
     log.info("Requeue failed start", extra={"mode": args.mode, "kind": args.kind})
 
-    with get_session() as s:
-        if args.kind in ("all", "feedbacks"):
-            if args.mode == "resend":
-                s.execute(text("UPDATE feedbacks SET status='generated' WHERE status='failed'"))
-            else:
-                s.execute(text("UPDATE feedbacks SET status='loaded', answer_text=NULL WHERE status='failed'"))
-
-        if args.kind in ("all", "questions"):
-            if args.mode == "resend":
-                s.execute(text("UPDATE questions SET status='generated' WHERE status='failed'"))
-            else:
-                s.execute(text("UPDATE questions SET status='loaded', answer_text=NULL WHERE status='failed'"))
+    if args.mode == "resend":
+        values = {"status": Status.generated}
+    else:
+        values = {"status": Status.loaded, "answer_text": None}
+
+    models = []
+    if args.kind in ("all", "feedbacks"):
+        models.append(Feedback)
+    if args.kind in ("all", "questions"):
+        models.append(Question)
 
+    with get_session() as s:
+        for model in models:
+            s.execute(update(model).where(model.status == Status.failed).values(**values))
         s.commit()
 
     log.info("Requeue failed done")
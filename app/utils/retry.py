@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import functools
+import logging
+import random
+import time
+from typing import Any, Callable, Iterable, TypeVar
+
+import requests
+
+log = logging.getLogger("app.utils.retry")
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def _retry_after(resp: requests.Response) -> float | None:
+    raw = resp.headers.get("Retry-After")
+    if not raw:
+        return None
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        return None
+
+
+def with_retry(
+    codes: Iterable[int] = RETRY_STATUSES,
+    max_attempts: int = 5,
+    base: float = 1.0,
+    cap: float = 16.0,
+) -> Callable[[F], F]:
+    """Повторяет вызов при HTTPError с кодом из ``codes``.
+
+    Пауза — decorrelated jitter (min(cap, U(base, prev * 3))), но не меньше
+    Retry-After, если сервер его прислал.
+    """
+    codes = frozenset(codes)
+
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            delay = base
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    return fn(*args, **kwargs)
+                except requests.HTTPError as e:
+                    resp = e.response
+                    if resp is None or resp.status_code not in codes or attempt >= max_attempts:
+                        raise
+                    delay = min(cap, random.uniform(base, delay * 3))
+                    sleep_sec = max(delay, _retry_after(resp) or 0.0)
+                    log.warning(
+                        "WB rate/5xx, retrying",
+                        extra={
+                            "url": resp.url,
+                            "status": resp.status_code,
+                            "attempt": attempt,
+                            "sleep_sec": round(sleep_sec, 2),
+                        },
+                    )
+                    time.sleep(sleep_sec)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
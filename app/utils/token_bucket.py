@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, n: float) -> float:
+        # токены берутся в долг под замком, спим уже без него
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def acquire(self, n: float = 1.0) -> None:
+        delay = self._reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, n: float = 1.0) -> None:
+        delay = self._reserve(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    # AIMD: на 429 темп делится пополам, после window секунд без 429 растёт на step
+    def __init__(
+        self,
+        capacity: float,
+        rate: float,
+        *,
+        min_rate: float = 0.05,
+        step: float | None = None,
+        window: float = 60.0,
+    ):
+        super().__init__(capacity, rate)
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.step = step if step is not None else rate / 10
+        self.window = window
+        self._probe_at = time.monotonic() + window
+
+    def throttled(self) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._probe_at = time.monotonic() + self.window
+
+    def _reserve(self, n: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            if self.rate < self.max_rate and now >= self._probe_at:
+                self.rate = min(self.max_rate, self.rate + self.step)
+                self._probe_at = now + self.window
+        return super()._reserve(n)
+
+
+# лимиты WB API отзывов/вопросов считаются на токен, чтение и запись раздельно
+_wb_buckets: dict[tuple[str, str], TokenBucket] = {}
+_wb_buckets_lock = threading.Lock()
+
+
+def wb_bucket(kind: str, token: str) -> TokenBucket:
+    key = (kind, token)
+    with _wb_buckets_lock:
+        bucket = _wb_buckets.get(key)
+        if bucket is None:
+            bucket = _wb_buckets[key] = TokenBucket(capacity=3.0, rate=3.0)
+        return bucket
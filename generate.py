@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+import logging
+import random
 import time
-from datetime import datetime
 
 from app.core.logger import setup_logging
 from app.db import get_session
@@ -11,6 +12,11 @@ from app.core.config import settings
 
 setup_logging()
 
+log = logging.getLogger("tools.generate")
+
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
 
 def get_gemini_token() -> str:
     """Получить Gemini токен от пользователя"""
@@ -37,24 +43,37 @@ def main():
     # Запрашиваем токен при запуске
     get_gemini_token()
 
-    print(f"[{datetime.now()}] Generating answers...")
+    log.info("Generating answers...")
 
-    while True:
-        with get_session() as s:
+    # одна сессия на весь цикл: generate_answers сам коммитит постранично
+    with get_session() as s:
+        attempt = 0
+        while True:
             fb, q, retry_after = generate_answers(s)
 
-        print(f"Generated answers: feedbacks={fb}, questions={q}")
-
-        if retry_after:
-            sleep_s = int(retry_after) + 2
-            print(f"Quota hit. Sleeping {sleep_s}s...")
-            time.sleep(sleep_s)
-            continue
-
-        if fb == 0 and q == 0:
-            break
-
-        time.sleep(1.0)
+            log.info(
+                "Generated answers: feedbacks=%s, questions=%s", fb, q,
+                extra={"event": "generate_pass", "generated": fb + q},
+            )
+
+            if retry_after:
+                # экспонента с джиттером, Retry-After от Gemini — нижняя граница
+                sleep_s = max(float(retry_after), min(BACKOFF_BASE * 2 ** attempt, BACKOFF_CAP))
+                sleep_s *= 1 + random.uniform(0, 0.5)
+                attempt += 1
+                log.warning(
+                    "Quota hit. Sleeping %.1fs...", sleep_s,
+                    extra={"retry_after": retry_after, "sleep_sec": round(sleep_s, 1)},
+                )
+                time.sleep(sleep_s)
+                continue
+
+            attempt = 0
+
+            if fb == 0 and q == 0:
+                break
+
+            time.sleep(1.0)
 
 
 if __name__ == "__main__":
@@ -1,44 +1,58 @@
 from __future__ import annotations
 
+import logging
 import sys
-import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Callable
+
+from sqlalchemy.orm import Session
 
 from app.core.logger import setup_logging
 from app.db import get_session
 from app.pipeline import ingest_feedbacks, ingest_feedbacks_archive
 
+log = logging.getLogger("tools.ingest")
+
+
+def _ingest(fn: Callable[[Session], int]) -> int:
+    with get_session() as session:
+        return fn(session)
+
 
 def main() -> int:
     setup_logging()
 
     started = datetime.now()
-    print(f"[{started}] Ingesting archived + regular feedbacks...")
+    log.info("Ingesting archived + regular feedbacks", extra={"event": "ingest_start"})
 
-    arch_count = 0
-    reg_count = 0
+    # архив и обычные отзывы независимы: качаем их параллельно, у каждого своя сессия
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        arch_fut = ex.submit(_ingest, ingest_feedbacks_archive)
+        reg_fut = ex.submit(_ingest, ingest_feedbacks)
 
-    # одна сессия на оба процесса — коммиты выполняются внутри функций
-    with get_session() as session:
         # 1) архив
+        arch_count = 0
         try:
-            arch_count = ingest_feedbacks_archive(session)
-            print(f"✅ Archived ingested: {arch_count}")
-        except Exception as e:
-            print("❌ Archived ingest failed:", e, file=sys.stderr)
-            traceback.print_exc()
+            arch_count = arch_fut.result()
+            log.info("Archived ingested: %s", arch_count)
+        except Exception:
+            log.exception("Archived ingest failed")
 
         # 2) обычные
+        reg_count = 0
         try:
-            reg_count = ingest_feedbacks(session)
-            print(f"✅ Regular ingested: {reg_count}")
-        except Exception as e:
-            print("❌ Regular ingest failed:", e, file=sys.stderr)
-            traceback.print_exc()
+            reg_count = reg_fut.result()
+            log.info("Regular ingested: %s", reg_count)
+        except Exception:
+            log.exception("Regular ingest failed")
 
     total = arch_count + reg_count
-    finished = datetime.now()
-    print(f"[{finished}] Done. Total ingested: {total} (archived={arch_count}, regular={reg_count})")
+    log.info(
+        "Done. Total ingested: %s (archived=%s, regular=%s) in %.1fs",
+        total, arch_count, reg_count, (datetime.now() - started).total_seconds(),
+        extra={"event": "ingest_done", "ingest": total},
+    )
 
     # Если обе части упали — вернуть ненулевой код
     return 0 if (arch_count or reg_count) else 1
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from datetime import datetime
+import logging
 
 from app.core.logger import setup_logging
 from app.db import get_session
@@ -9,12 +9,14 @@ from app.pipeline import send_to_wb
 
 setup_logging()
 
+log = logging.getLogger("tools.send")
+
 
 def main():
-    print(f"[{datetime.now()}] Sending to WB...")
+    log.info("Sending to WB...")
     with get_session() as s:
         fb, q = send_to_wb(s)
-    print(f"✅ Sent to WB: feedbacks={fb}, questions={q}")
+    log.info("Sent to WB: feedbacks=%s, questions=%s", fb, q, extra={"event": "send_done", "sent": fb + q})
 
 
 if __name__ == "__main__":